@@ -8,19 +8,25 @@ style.
 
 import datetime as dt
 import uuid
-from collections import defaultdict
-from typing import Any, Optional, Union
+from typing import Any, Iterable, Optional, Union
 
 import sqlalchemy as sa
 import structlog
 from fastapi import HTTPException
 from pvsite_datamodel import SiteGroupSQL, UserSQL
 from pvsite_datamodel.read.generation import get_pv_generation_by_sites
-from pvsite_datamodel.read.user import get_user_by_email
-from pvsite_datamodel.sqlmodels import ForecastSQL, ForecastValueSQL, SiteGroupSiteSQL, SiteSQL
+from pvsite_datamodel.sqlmodels import (
+    ForecastSQL,
+    ForecastValueSQL,
+    GenerationSQL,
+    SiteGroupSiteSQL,
+    SiteSQL,
+)
 from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.orm import Session, aliased
 
+from .cache import SITE_CACHE_MAX_SIZE, TTLCache, site_cache_time_seconds
 from .convert import (
     forecast_rows_sums_to_pydantic_objects,
     forecast_rows_to_pydantic,
@@ -34,7 +40,6 @@ from .pydantic_models import (
     ManyForecastCompact,
     MultiplePVActual,
     MultipleSitePVActualCompact,
-    PVActualValue,
     PVSiteMetadata,
 )
 
@@ -44,117 +49,148 @@ logger = structlog.stdlib.get_logger()
 # Sqlalchemy rows are tricky to type: we use this to make the code more readable.
 Row = Any
 
+# Number of rows fetched at a time when streaming large results from the database.
+YIELD_PER = 1000
 
-def _get_forecasts_for_horizon(
-    session: Session,
-    site_uuids: list[str],
+# Sites rarely change, so we keep them in memory for a short time.
+_site_exists_cache = TTLCache(
+    cache_time_seconds=site_cache_time_seconds, max_size=SITE_CACHE_MAX_SIZE
+)
+_sites_cache = TTLCache(cache_time_seconds=site_cache_time_seconds, max_size=SITE_CACHE_MAX_SIZE)
+
+
+def _sum_forecasts_query(query: sa.Select, sum_by: str) -> sa.Select:
+    """Sum the forecast values of a query by total, dno or gsp."""
+    subquery = query.subquery()
+
+    group_by_variables = [subquery.c.start_utc]
+    if sum_by == "dno":
+        group_by_variables.append(SiteSQL.dno)
+    if sum_by == "gsp":
+        group_by_variables.append(SiteSQL.gsp)
+    query_variables = group_by_variables.copy()
+    query_variables.append(func.sum(subquery.c.forecast_power_kw))
+
+    return (
+        sa.select(*query_variables)
+        .select_from(subquery)
+        .join(ForecastSQL, ForecastSQL.forecast_uuid == subquery.c.forecast_uuid)
+        .join(SiteSQL)
+        .group_by(*group_by_variables)
+        .order_by(*group_by_variables)
+    )
+
+
+def _forecast_columns(forecast=ForecastSQL) -> list:
+    """Columns of `forecast` and `ForecastValueSQL` needed to make our pydantic forecasts.
+
+    We select these columns rather than the whole ORM objects, to avoid their overhead.
+    """
+    return [
+        forecast.forecast_uuid,
+        forecast.site_uuid,
+        forecast.timestamp_utc,
+        forecast.forecast_version,
+        ForecastValueSQL.forecast_value_uuid,
+        ForecastValueSQL.start_utc,
+        ForecastValueSQL.forecast_power_kw,
+    ]
+
+
+def _get_forecasts_for_horizon_query(
+    site_uuids: list[uuid.UUID],
     start_utc: dt.datetime,
     end_utc: dt.datetime,
     horizon_minutes: int,
-    sum_by: Optional[str] = None,
-) -> list[Row]:
-    """Get the forecasts for given sites for a given horizon."""
-    query = (
-        session.query(ForecastSQL, ForecastValueSQL)
-        # We need a DISTINCT ON statement in cases where we have run two forecasts for the same
-        # time. In practice this shouldn't happen often.
-        .distinct(ForecastSQL.site_uuid, ForecastSQL.timestamp_utc)
+) -> sa.Select:
+    """Query the forecasts for given sites for a given horizon."""
+    # We need to remove duplicates in cases where we have run two forecasts for the same time. In
+    # practice this shouldn't happen often, so rather than sorting everything with a DISTINCT ON,
+    # we skip a forecast when there is another one for the same site and time, with values that
+    # would be selected too. This anti-join can use the (site_uuid, timestamp_utc) index, as we
+    # repeat the filters on those columns.
+    start_utc_forecast = start_utc - dt.timedelta(minutes=horizon_minutes)
+    other_forecast = aliased(ForecastSQL)
+    other_forecast_value = aliased(ForecastValueSQL)
+    duplicate_forecast_exists = (
+        sa.select(other_forecast.forecast_uuid)
+        .join(
+            other_forecast_value,
+            other_forecast_value.forecast_uuid == other_forecast.forecast_uuid,
+        )
+        .where(other_forecast.site_uuid.in_(site_uuids))
+        .where(other_forecast.timestamp_utc >= start_utc_forecast)
+        .where(other_forecast.timestamp_utc < end_utc)
+        .where(other_forecast.site_uuid == ForecastSQL.site_uuid)
+        .where(other_forecast.timestamp_utc == ForecastSQL.timestamp_utc)
+        .where(other_forecast.forecast_uuid > ForecastSQL.forecast_uuid)
+        .where(other_forecast_value.horizon_minutes == horizon_minutes)
+        .where(other_forecast_value.start_utc >= start_utc)
+        .where(other_forecast_value.start_utc < end_utc)
+        .exists()
+    )
+
+    return (
+        sa.select(*_forecast_columns())
         .join(ForecastValueSQL)
+        .where(~duplicate_forecast_exists)
         .where(ForecastSQL.site_uuid.in_(site_uuids))
         # Also filtering on `timestamp_utc` makes the query faster.
-        .where(ForecastSQL.timestamp_utc >= start_utc - dt.timedelta(minutes=horizon_minutes))
+        .where(ForecastSQL.timestamp_utc >= start_utc_forecast)
         .where(ForecastSQL.timestamp_utc < end_utc)
         .where(ForecastValueSQL.horizon_minutes == horizon_minutes)
+        # Bounding `start_utc` on both sides lets the database only look at the index range, or
+        # the partitions, covering the time window.
         .where(ForecastValueSQL.start_utc >= start_utc)
         .where(ForecastValueSQL.start_utc < end_utc)
-        .order_by(ForecastSQL.site_uuid, ForecastSQL.timestamp_utc)
     )
 
-    if sum_by is not None:
-        subquery = query.subquery()
-
-        group_by_variables = [subquery.c.start_utc]
-        if sum_by == "dno":
-            group_by_variables.append(SiteSQL.dno)
-        if sum_by == "gsp":
-            group_by_variables.append(SiteSQL.gsp)
-        query_variables = group_by_variables.copy()
-        query_variables.append(func.sum(subquery.c.forecast_power_kw))
-
-        query = session.query(*query_variables)
-        query = query.join(ForecastSQL, ForecastSQL.forecast_uuid == subquery.c.forecast_uuid)
-        query = query.join(SiteSQL)
-        query = query.group_by(*group_by_variables)
-        query = query.order_by(*group_by_variables)
-        forecasts_raw = query.all()
-
-    else:
-        forecasts_raw = query.all()
-
-    return forecasts_raw
 
-
-def _get_latest_forecast_by_sites(
-    session: Session,
-    site_uuids: list[str],
+def _get_latest_forecast_by_sites_query(
+    site_uuids: list[uuid.UUID],
     start_utc: Optional[dt.datetime] = None,
     end_utc: Optional[dt.datetime] = None,
-    sum_by: Optional[str] = None,
-) -> list[Row]:
-    """Get the latest forecast for given site uuids."""
-    # Get the latest forecast for each site.
-    subquery = (
-        session.query(ForecastSQL)
-        .distinct(ForecastSQL.site_uuid)
-        .filter(ForecastSQL.site_uuid.in_([uuid.UUID(su) for su in site_uuids]))
-        .order_by(
-            ForecastSQL.site_uuid,
-            ForecastSQL.timestamp_utc.desc(),
-        )
-    ).subquery()
+) -> sa.Select:
+    """Query the latest forecast for given site uuids."""
+    # Get the latest forecast for each site. For each site, this is a backward scan of the
+    # (site_uuid, timestamp_utc) index that stops at the first row, rather than a DISTINCT ON
+    # that sorts all the forecasts of the sites.
+    latest_forecast = (
+        sa.select(ForecastSQL)
+        .where(ForecastSQL.site_uuid == SiteSQL.site_uuid)
+        .order_by(ForecastSQL.timestamp_utc.desc())
+        .limit(1)
+        .lateral()
+    )
 
-    forecast_subq = aliased(ForecastSQL, subquery, name="ForecastSQL")
+    forecast_subq = aliased(ForecastSQL, latest_forecast, name="ForecastSQL")
 
     # Join the forecast values.
-    query = session.query(forecast_subq, ForecastValueSQL)
-    query = query.join(ForecastValueSQL)
+    query = (
+        sa.select(*_forecast_columns(forecast_subq))
+        .select_from(SiteSQL)
+        .join(forecast_subq, sa.true())
+        .join(ForecastValueSQL, ForecastValueSQL.forecast_uuid == forecast_subq.forecast_uuid)
+        .where(SiteSQL.site_uuid.in_(site_uuids))
+    )
 
     # only get future forecast values. This solves the case when a forecast is made 1 day a go,
     # but since then, no new forecast have been made
     if start_utc is not None:
-        query = query.filter(ForecastValueSQL.start_utc >= start_utc)
+        query = query.where(ForecastValueSQL.start_utc >= start_utc)
 
     if end_utc is not None:
-        query = query.filter(ForecastValueSQL.end_utc <= end_utc)
-
-    query.order_by(forecast_subq.timestamp_utc, ForecastValueSQL.start_utc)
-
-    if sum_by is None:
-        return query.all()
-    else:
-        subquery = query.subquery()
-
-        group_by_variables = [subquery.c.start_utc]
-        if sum_by == "dno":
-            group_by_variables.append(SiteSQL.dno)
-        if sum_by == "gsp":
-            group_by_variables.append(SiteSQL.gsp)
-        query_variables = group_by_variables.copy()
-        query_variables.append(func.sum(subquery.c.forecast_power_kw))
+        # The filter on `start_utc` is implied by the one on `end_utc`, but it bounds the time
+        # window on the column the database can prune on.
+        query = query.where(ForecastValueSQL.start_utc < end_utc)
+        query = query.where(ForecastValueSQL.end_utc <= end_utc)
 
-        query = session.query(*query_variables)
-        query = query.join(ForecastSQL, ForecastSQL.forecast_uuid == subquery.c.forecast_uuid)
-        query = query.join(SiteSQL)
-        query = query.group_by(*group_by_variables)
-        query = query.order_by(*group_by_variables)
-        forecasts_raw = query.all()
-
-        return forecasts_raw
+    return query
 
 
 def get_forecasts_by_sites(
     session: Session,
-    site_uuids: list[str],
+    site_uuids: list[uuid.UUID],
     start_utc: dt.datetime,
     horizon_minutes: int,
     compact: bool = False,
@@ -164,6 +200,10 @@ def get_forecasts_by_sites(
     """Combination of the latest forecast and the past forecasts, for given sites.
 
     This is what we show in the UI.
+
+    Both the past and the latest forecasts are fetched in one round-trip to the database, using a
+    UNION ALL. Each row is tagged with a `source` column (0 for past, 1 for latest), which is
+    used to keep the rows of each part together.
     """
 
     logger.info(f"Getting forecast for {len(site_uuids)} sites")
@@ -172,37 +212,91 @@ def get_forecasts_by_sites(
     if (end_utc is not None) and (end_utc < end_utc_past):
         end_utc_past = end_utc
 
-    rows_past = _get_forecasts_for_horizon(
-        session,
+    query_past = _get_forecasts_for_horizon_query(
         site_uuids=site_uuids,
         start_utc=start_utc,
         end_utc=end_utc_past,
         horizon_minutes=horizon_minutes,
-        sum_by=sum_by,
     )
-    logger.debug("Found %s past forecasts", len(rows_past))
+    query_future = _get_latest_forecast_by_sites_query(
+        site_uuids=site_uuids, start_utc=start_utc, end_utc=end_utc
+    )
 
-    rows_future = _get_latest_forecast_by_sites(
-        session=session, site_uuids=site_uuids, start_utc=start_utc, sum_by=sum_by, end_utc=end_utc
+    if sum_by is not None:
+        query_past = _sum_forecasts_query(query_past, sum_by=sum_by)
+        query_future = _sum_forecasts_query(query_future, sum_by=sum_by)
+
+    query = sa.union_all(
+        query_past.add_columns(sa.literal(0).label("source")),
+        query_future.add_columns(sa.literal(1).label("source")),
     )
-    logger.debug("Found %s future forecasts", len(rows_future))
 
     if sum_by is not None:
-        forecasts = forecast_rows_sums_to_pydantic_objects(rows_future + rows_past)
+        # The sums of the latest forecast come first, and we drop the `source` column again.
+        *sum_columns, source = query.subquery().c
+        query = sa.select(*sum_columns).order_by(source.desc(), *sum_columns[:-1])
+        rows = session.execute(query).all()
+        logger.debug("Found %s forecast sums", len(rows))
+
+        return forecast_rows_sums_to_pydantic_objects(rows)
+
+    columns = query.selected_columns
+    query = query.order_by(
+        columns.source, columns.site_uuid, columns.timestamp_utc, columns.start_utc
+    )
+    # Stream the rows into the pydantic conversion instead of loading them all in memory first.
+    rows = session.execute(query.execution_options(yield_per=YIELD_PER))
+
+    logger.debug("Formatting forecasts to pydantic objects")
+    if compact:
+        forecasts = forecast_rows_to_pydantic_compact(rows)
     else:
-        logger.debug("Formatting forecasts to pydantic objects")
-        if compact:
-            forecasts = forecast_rows_to_pydantic_compact(rows_past + rows_future)
-        else:
-            forecasts = forecast_rows_to_pydantic(rows_past + rows_future)
-        logger.debug("Formatting forecasts to pydantic objects: done")
+        forecasts = forecast_rows_to_pydantic(rows)
+    logger.debug("Formatting forecasts to pydantic objects: done")
 
     return forecasts
 
 
+def _get_generation_per_site(
+    session: Session,
+    site_uuids: list[uuid.UUID],
+    start_utc: dt.datetime,
+    end_utc: Optional[dt.datetime] = None,
+) -> Iterable[Row]:
+    """Get the generation for given sites, with one row per site.
+
+    Each row has the `site_uuid`, and the `start_utc` and `generation_power_kw` arrays of that
+    site, ordered by `start_utc`. Grouping the values by site is done in the database.
+    """
+    query = (
+        sa.select(
+            GenerationSQL.site_uuid,
+            func.array_agg(
+                aggregate_order_by(GenerationSQL.start_utc, GenerationSQL.start_utc)
+            ).label("start_utc"),
+            func.array_agg(
+                aggregate_order_by(GenerationSQL.generation_power_kw, GenerationSQL.start_utc)
+            ).label("generation_power_kw"),
+        )
+        .where(GenerationSQL.site_uuid.in_(site_uuids))
+        .where(GenerationSQL.start_utc >= start_utc)
+        .group_by(GenerationSQL.site_uuid)
+        .order_by(GenerationSQL.site_uuid)
+    )
+
+    if end_utc is not None:
+        # The filter on `start_utc` is implied by the one on `end_utc`, but it bounds the time
+        # window on the column the database can prune on.
+        query = query.where(GenerationSQL.start_utc < end_utc)
+        query = query.where(GenerationSQL.end_utc < end_utc)
+
+    # Stream the rows, as each of them holds all the values of a site.
+    return session.execute(query.execution_options(yield_per=YIELD_PER))
+
+
 def get_generation_by_sites(
     session: Session,
-    site_uuids: list[str],
+    site_uuids: list[uuid.UUID],
     start_utc: dt.datetime,
     compact: bool = False,
     sum_by: Optional[str] = None,
@@ -210,40 +304,62 @@ def get_generation_by_sites(
 ) -> Union[list[MultiplePVActual], MultipleSitePVActualCompact]:
     """Get the generation since yesterday (midnight) for a list of sites."""
     logger.info(f"Getting generation for {len(site_uuids)} sites")
-    rows = get_pv_generation_by_sites(
-        session=session,
-        start_utc=start_utc,
-        end_utc=end_utc,
-        site_uuids=[uuid.UUID(su) for su in site_uuids],
-        sum_by=sum_by,
-    )
-
-    # Go through the rows and split the data by site.
-    pv_actual_values_per_site: dict[str, list[PVActualValue]] = defaultdict(list)
 
     if sum_by is not None:
-        return rows
+        return get_pv_generation_by_sites(
+            session=session,
+            start_utc=start_utc,
+            end_utc=end_utc,
+            site_uuids=site_uuids,
+            sum_by=sum_by,
+        )
+
+    rows = _get_generation_per_site(
+        session=session, site_uuids=site_uuids, start_utc=start_utc, end_utc=end_utc
+    )
 
-    # TODO can we speed this up?
     if not compact:
-        return generation_rows_to_pydantic(pv_actual_values_per_site, rows, site_uuids)
+        return generation_rows_to_pydantic(rows)
     else:
         return generation_rows_to_pydantic_compact(rows)
 
 
-def get_sites_by_uuids(session: Session, site_uuids: list[str]) -> list[PVSiteMetadata]:
-    sites = session.query(SiteSQL).where(SiteSQL.site_uuid.in_(site_uuids)).all()
-    pydantic_sites = [site_to_pydantic(site) for site in sites]
-    return pydantic_sites
+def get_sites_by_uuids(session: Session, site_uuids: list[uuid.UUID]) -> list[PVSiteMetadata]:
+    """Get the sites for given site uuids, in the same order, without duplicates.
+
+    The sites are cached for a short time, and only the ones missing from the cache are queried.
+    """
+    # drop the duplicates, keeping the order
+    site_uuids = list(dict.fromkeys(site_uuids))
+
+    pydantic_sites = {}
+    missing_site_uuids = []
+    for site_uuid in site_uuids:
+        pv_site = _sites_cache.get(str(site_uuid))
+        if pv_site is None:
+            missing_site_uuids.append(site_uuid)
+        else:
+            pydantic_sites[site_uuid] = pv_site
+
+    if len(missing_site_uuids) > 0:
+        sites = session.query(SiteSQL).where(SiteSQL.site_uuid.in_(missing_site_uuids)).all()
+        for site in sites:
+            pv_site = site_to_pydantic(site)
+            _sites_cache.set(str(site.site_uuid), pv_site)
+            pydantic_sites[site.site_uuid] = pv_site
+
+    return [pydantic_sites[site_uuid] for site_uuid in site_uuids if site_uuid in pydantic_sites]
 
 
 def site_to_pydantic(site: SiteSQL) -> PVSiteMetadata:
-    """Converts a SiteSQL object into a PVSiteMetadata object."""
-    pv_site = PVSiteMetadata(
-        site_uuid=str(site.site_uuid),
-        client_site_id=str(site.client_site_id),
+    """Converts a SiteSQL object into a PVSiteMetadata object.
+
+    The data comes straight from the database, so we skip the pydantic validation.
+    """
+    pv_site = PVSiteMetadata.model_construct(
+        site_uuid=site.site_uuid,
+        client_site_id=site.client_site_id,
         client_site_name=str(site.client_site_name),
-        region=site.region,
         dno=site.dno,
         gsp=site.gsp,
         latitude=site.latitude,
@@ -252,58 +368,100 @@ def site_to_pydantic(site: SiteSQL) -> PVSiteMetadata:
         orientation=site.orientation,
         inverter_capacity_kw=site.inverter_capacity_kw,
         module_capacity_kw=site.module_capacity_kw,
-        created_utc=site.created_utc,
         capacity_kw=site.capacity_kw,
     )
     return pv_site
 
 
 def does_site_exist(session: Session, site_uuid: str) -> bool:
-    """Checks if a site exists."""
-    return (
+    """Checks if a site exists.
+
+    Sites that exist are cached for a short time. We don't cache the sites that don't exist, so
+    that new sites can be used straight away.
+    """
+    # the caches are keyed on the canonical form of the uuids
+    try:
+        site_uuid = str(uuid.UUID(site_uuid))
+    except ValueError:
+        # there is no site with an invalid uuid
+        return False
+
+    if _site_exists_cache.get(site_uuid, False):
+        return True
+
+    site_exists = (
         session.execute(sa.select(SiteSQL).where(SiteSQL.site_uuid == site_uuid)).one_or_none()
         is not None
     )
+    if site_exists:
+        _site_exists_cache.set(site_uuid, True)
+
+    return site_exists
+
+
+def invalidate_site_cache(site_uuid: str):
+    """Remove a site from the caches, for example after it has been edited or deleted."""
+    try:
+        site_uuid = str(uuid.UUID(site_uuid))
+    except ValueError:
+        # an invalid uuid is never cached
+        return
 
+    _site_exists_cache.pop(site_uuid)
+    _sites_cache.pop(site_uuid)
 
-def check_user_has_access_to_site(session: Session, auth: dict, site_uuid: str):
+
+def _get_user_site_uuids(session: Session, user: UserSQL) -> set[str]:
+    """Get the uuids of the sites a user has access to.
+
+    The result is kept on the session, which only lives for one request, so that routes calling
+    other routes don't query it again.
+    """
+    key = ("user_site_uuids", user.user_uuid)
+    if key not in session.info:
+        query = sa.select(SiteGroupSiteSQL.site_uuid).where(
+            SiteGroupSiteSQL.site_group_uuid == user.site_group_uuid
+        )
+        session.info[key] = {str(site_uuid) for site_uuid in session.scalars(query)}
+    return session.info[key]
+
+
+def check_user_has_access_to_site(session: Session, user: UserSQL, site_uuid: str):
     """
     Checks if a user has access to a site.
     """
-    assert isinstance(auth, dict)
-    email = auth["https://openclimatefix.org/email"]
-
-    user = get_user_by_email(session=session, email=email)
-    site_uuids = [str(site.site_uuid) for site in user.site_group.sites]
+    # compare the canonical form, as the uuid may have been given in upper case for example
+    try:
+        site_uuid = str(uuid.UUID(site_uuid))
+    except ValueError:
+        # an invalid uuid can't be one of the user's sites
+        pass
+
+    site_uuids = _get_user_site_uuids(session=session, user=user)
     if site_uuid not in site_uuids:
         raise HTTPException(
             status_code=403,
-            detail=f"Forbidden. User ({email}) "
+            detail=f"Forbidden. User ({user.email}) "
             f"does not have access to this site {site_uuid}. "
-            f"User has access to {site_uuids}",
+            f"User has access to {sorted(site_uuids)}",
         )
 
 
-def check_user_has_access_to_sites(session: Session, auth: dict, site_uuids: list[str]):
+def check_user_has_access_to_sites(session: Session, user: UserSQL, site_uuids: list[uuid.UUID]):
     """
     Checks if a user has access to a list of sites.
     """
-    assert isinstance(auth, dict)
-    email = auth["https://openclimatefix.org/email"]
-
-    user = get_user_by_email(session=session, email=email)
-    user_site_uuids = sorted([str(site.site_uuid) for site in user.site_group.sites])
-    site_uuids = sorted(site_uuids)
-
-    if user_site_uuids != site_uuids:
-        for site_uuid in site_uuids:
-            if site_uuid not in site_uuids:
-                raise HTTPException(
-                    status_code=403,
-                    detail=f"Forbidden. User ({email}) "
-                    f"does not have access to this site {site_uuid}. "
-                    f"User has access to {site_uuids}",
-                )
+    user_site_uuids = _get_user_site_uuids(session=session, user=user)
+
+    # compare the canonical forms, as the uuids may have been given in upper case for example
+    missing_site_uuids = {str(site_uuid) for site_uuid in site_uuids} - user_site_uuids
+    if missing_site_uuids:
+        raise HTTPException(
+            status_code=403,
+            detail=f"Forbidden. User ({user.email}) "
+            f"does not have access to these sites {sorted(missing_site_uuids)}. "
+            f"User has access to {sorted(user_site_uuids)}",
+        )
 
 
 def get_sites_from_user(session, user, lat_lon_limits: Optional[LatitudeLongitudeLimits] = None):
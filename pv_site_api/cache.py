@@ -2,6 +2,7 @@
 
 import json
 import os
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from functools import wraps
 
@@ -14,8 +15,11 @@ logger = structlog.stdlib.get_logger()
 
 CACHE_TIME_SECONDS = 120
 DELETE_CACHE_TIME_SECONDS = 240
+SITE_CACHE_TIME_SECONDS = 60
+SITE_CACHE_MAX_SIZE = 10_000
 cache_time_seconds = int(os.getenv("CACHE_TIME_SECONDS", CACHE_TIME_SECONDS))
 delete_cache_time_seconds = int(os.getenv("DELETE_CACHE_TIME_SECONDS", DELETE_CACHE_TIME_SECONDS))
+site_cache_time_seconds = int(os.getenv("SITE_CACHE_TIME_SECONDS", SITE_CACHE_TIME_SECONDS))
 
 
 def remove_old_cache(
@@ -46,6 +50,63 @@ def remove_old_cache(
     return last_updated, response
 
 
+class TTLCache:
+    """
+    Small in-memory cache, where each entry is only used for a given time.
+
+    This is used for data that rarely changes, like the sites.
+    """
+
+    def __init__(self, cache_time_seconds: float, max_size: int):
+        """
+        :param cache_time_seconds: the amount of time an entry is kept for
+        :param max_size: the maximum number of entries
+        """
+        self.cache_time_seconds = cache_time_seconds
+        self.max_size = max_size
+        # The time each entry was set and its value are stored together, so that a concurrent
+        # `pop` or `set` from another request can't remove one without the other. The entries are
+        # kept in the order they were set, so the oldest one comes first.
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        """Get an entry from the cache, or `default` if it is not there or too old."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+
+        last_updated, value = entry
+        if (
+            datetime.now(tz=timezone.utc) - timedelta(seconds=self.cache_time_seconds)
+            > last_updated
+        ):
+            self.pop(key)
+            return default
+
+        return value
+
+    def set(self, key, value):
+        """Add an entry to the cache, dropping the oldest entries if it is full."""
+        self.pop(key)
+
+        while len(self.entries) >= self.max_size:
+            try:
+                self.entries.popitem(last=False)
+            except KeyError:
+                # emptied by another request in the meantime
+                break
+
+        self.entries[key] = (datetime.now(tz=timezone.utc), value)
+
+    def pop(self, key):
+        """Remove an entry from the cache, if it is there."""
+        self.entries.pop(key, None)
+
+    def clear(self):
+        """Remove all the entries from the cache."""
+        self.entries.clear()
+
+
 def cache_response(func):
     """
     Decorator that caches the response of a FastAPI async function.
@@ -76,16 +137,16 @@ def cache_response(func):
         session = route_variables.get("session", None)
         auth = route_variables.get("auth", None)
         request = route_variables.get("request", None)
+        user = route_variables.get("user", None)
         if request:
             url = str(request.url)
         else:
             url = None
 
-        if auth is not None:
+        # the user is normally loaded by the route's dependencies already
+        if user is None and auth is not None:
             email = auth["https://openclimatefix.org/email"]
             user = get_user_by_email(email=email, session=session)
-        else:
-            user = None
 
         save_api_call_to_db(url=url, session=session, user=user)
 
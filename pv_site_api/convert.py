@@ -1,7 +1,11 @@
-"""Functions to convert sql rows to pydantic models."""
-import uuid
-from collections import defaultdict
-from typing import Any
+"""Functions to convert sql rows to pydantic models.
+
+The rows come straight from the database, so the pydantic objects are made with `model_construct`
+which skips the validation. Routes with a `response_model` validate the response when FastAPI
+serializes it, but routes without one, like `/sites/pv_forecast`, return the objects unvalidated.
+"""
+import datetime as dt
+from typing import Any, Iterable
 
 import numpy as np
 import structlog
@@ -24,158 +28,171 @@ logger = structlog.stdlib.get_logger()
 Row = Any
 
 
-def forecast_rows_to_pydantic_compact(rows: list[Row]) -> ManyForecastCompact:
-    """Make a list of `(ForecastSQL, ForecastValueSQL)` rows into our pydantic `Forecast`
-    objects.
+def round_values(values: list[float]) -> list[float]:
+    """Round values to 3 decimals.
 
-    Note that we remove duplicate ForecastValueSQL when found.
+    This always uses numpy, as python's `round` can give a different result for values close to
+    a half.
     """
-    # Per-site metadata.
-    data: dict[str, dict[str, Any]] = defaultdict(dict)
-    # Per-site forecast values.
-    defaultdict(list)
-    # Per-site *set* of ForecastValueSQL.forecast_value_uuid to be able to filter out duplicates.
-    # This is useful in particular because our latest forecast and past forecasts will overlap in
-    # the middle.
-    fv_uuids: dict[str, set[uuid.UUID]] = defaultdict(set)
-    start_utc_idx: dict[str, int] = {}
+    return np.round(np.asarray(values, dtype=float), 3).tolist()
 
-    for row in rows:
-        site_uuid = str(row.ForecastSQL.site_uuid)
 
-        start_utc = row.ForecastValueSQL.start_utc
-        expected_generation_kw = round(row.ForecastValueSQL.forecast_power_kw, 3)
+def forecast_rows_to_pydantic_compact(rows: Iterable[Row]) -> ManyForecastCompact:
+    """Make a list of forecast rows into our pydantic `Forecast` objects.
+
+    The rows have the `ForecastSQL` and `ForecastValueSQL` columns listed in
+    `_db_helpers._forecast_columns`.
 
-        if start_utc not in start_utc_idx:
-            start_utc_idx[start_utc] = len(start_utc_idx)
-        idx = start_utc_idx[start_utc]
+    Note that we remove duplicate ForecastValueSQL when found.
+    """
+    # In this loop, we key the sites by `uuid.UUID.int`, which is much faster to hash than the
+    # `uuid.UUID` itself, and we only convert the site uuids to strings once per site.
+    # Per-site metadata.
+    data: dict[int, dict[str, Any]] = {}
+    # Per-site forecast values, by index of their `start_utc`.
+    values: dict[int, dict[int, float]] = {}
+    start_utc_idx: dict[dt.datetime, int] = {}
 
-        if site_uuid not in data:
-            data[site_uuid]["site_uuid"] = site_uuid
-            data[site_uuid]["forecast_uuid"] = str(row.ForecastSQL.forecast_uuid)
-            data[site_uuid]["forecast_creation_datetime"] = row.ForecastSQL.timestamp_utc
-            data[site_uuid]["forecast_version"] = row.ForecastSQL.forecast_version
+    for row in rows:
+        site_key = row.site_uuid.int
 
-        if site_uuid not in fv_uuids:
-            fv_uuids[site_uuid] = {idx: expected_generation_kw}
-        else:
-            fv_uuids[site_uuid][idx] = expected_generation_kw
+        start_utc = row.start_utc
+        idx = start_utc_idx.get(start_utc)
+        if idx is None:
+            idx = start_utc_idx[start_utc] = len(start_utc_idx)
+
+        site_values = values.get(site_key)
+        if site_values is None:
+            data[site_key] = {
+                "site_uuid": str(row.site_uuid),
+                "forecast_uuid": str(row.forecast_uuid),
+                "forecast_creation_datetime": row.timestamp_utc,
+                "forecast_version": row.forecast_version,
+            }
+            site_values = values[site_key] = {}
+
+        site_values[idx] = round(row.forecast_power_kw, 3)
 
     forecasts = [
-        ForecastCompact(
-            forecast_values=fv_uuids[site_uuid],
-            **data[site_uuid],
-        )
-        for site_uuid in data.keys()
+        ForecastCompact.model_construct(forecast_values=values[site_key], **site_data)
+        for site_key, site_data in data.items()
     ]
-    f = ManyForecastCompact(forecasts=forecasts, target_time_idx=start_utc_idx)
+    f = ManyForecastCompact.model_construct(forecasts=forecasts, target_time_idx=start_utc_idx)
     return f
 
 
-def forecast_rows_to_pydantic(rows: list[Row]) -> list[Forecast]:
-    """Make a list of `(ForecastSQL, ForecastValueSQL)` rows into our pydantic `Forecast`
-    objects.
+def forecast_rows_to_pydantic(rows: Iterable[Row]) -> list[Forecast]:
+    """Make a list of forecast rows into our pydantic `Forecast` objects.
+
+    The rows have the `ForecastSQL` and `ForecastValueSQL` columns listed in
+    `_db_helpers._forecast_columns`.
 
     Note that we remove duplicate ForecastValueSQL when found.
     """
+    # In this loop, we key the sites and forecast values by `uuid.UUID.int`, which is much faster
+    # to hash than the `uuid.UUID` itself, and we only convert the site uuids to strings once per
+    # site.
+    make_forecast_value = SiteForecastValues.model_construct
     # Per-site metadata.
-    data: dict[str, dict[str, Any]] = defaultdict(dict)
+    data: dict[int, dict[str, Any]] = {}
     # Per-site forecast values.
-    values: dict[str, list[SiteForecastValues]] = defaultdict(list)
-    # Per-site *set* of ForecastValueSQL.forecast_value_uuid to be able to filter out duplicates.
+    values: dict[int, list[SiteForecastValues]] = {}
+    # *Set* of ForecastValueSQL.forecast_value_uuid to be able to filter out duplicates.
     # This is useful in particular because our latest forecast and past forecasts will overlap in
     # the middle.
-    fv_uuids: dict[str, set[uuid.UUID]] = defaultdict(set)
+    fv_uuids: set[int] = set()
 
     for row in rows:
-        site_uuid = str(row.ForecastSQL.site_uuid)
-
-        if site_uuid not in data:
-            data[site_uuid]["site_uuid"] = site_uuid
-            data[site_uuid]["forecast_uuid"] = str(row.ForecastSQL.forecast_uuid)
-            data[site_uuid]["forecast_creation_datetime"] = row.ForecastSQL.timestamp_utc
-            data[site_uuid]["forecast_version"] = row.ForecastSQL.forecast_version
+        site_key = row.site_uuid.int
+
+        site_data = data.get(site_key)
+        if site_data is None:
+            site_data = data[site_key] = {
+                "site_uuid": str(row.site_uuid),
+                "forecast_uuid": str(row.forecast_uuid),
+                "forecast_creation_datetime": row.timestamp_utc,
+                "forecast_version": row.forecast_version,
+            }
+            values[site_key] = []
 
         # make sure we use the latest forecast_creation_datetime
-        if row.ForecastSQL.timestamp_utc > data[site_uuid]["forecast_creation_datetime"]:
-            data[site_uuid]["forecast_creation_datetime"] = row.ForecastSQL.timestamp_utc
-            data[site_uuid]["forecast_uuid"] = str(row.ForecastSQL.forecast_uuid)
-            data[site_uuid]["forecast_version"] = row.ForecastSQL.forecast_version
-
-        fv_uuid = row.ForecastValueSQL.forecast_value_uuid
-
-        if fv_uuid not in fv_uuids[site_uuid]:
-            values[site_uuid].append(
-                SiteForecastValues(
-                    target_datetime_utc=row.ForecastValueSQL.start_utc,
-                    expected_generation_kw=row.ForecastValueSQL.forecast_power_kw,
+        elif row.timestamp_utc > site_data["forecast_creation_datetime"]:
+            site_data["forecast_creation_datetime"] = row.timestamp_utc
+            site_data["forecast_uuid"] = str(row.forecast_uuid)
+            site_data["forecast_version"] = row.forecast_version
+
+        fv_uuid = row.forecast_value_uuid.int
+
+        if fv_uuid not in fv_uuids:
+            values[site_key].append(
+                make_forecast_value(
+                    target_datetime_utc=row.start_utc,
+                    expected_generation_kw=round(row.forecast_power_kw, 3),
                 )
             )
-            fv_uuids[site_uuid].add(fv_uuid)
+            fv_uuids.add(fv_uuid)
 
     return [
-        Forecast(
-            forecast_values=values[site_uuid],
-            **data[site_uuid],
-        )
-        for site_uuid in data.keys()
+        Forecast.model_construct(forecast_values=values[site_key], **site_data)
+        for site_key, site_data in data.items()
     ]
 
 
-def generation_rows_to_pydantic(pv_actual_values_per_site, rows, site_uuids):
-    """Convert generation rows to a MultiplePVActual object."""
-    logger.info("Formatting generation 1")
+def generation_rows_to_pydantic(rows: Iterable[Row]) -> list[MultiplePVActual]:
+    """Convert generation rows to a list of MultiplePVActual objects.
+
+    Each row holds all the generation values of one site, already grouped and ordered by the
+    database.
+    """
+    multiple_pv_actuals = []
     for row in rows:
-        site_uuid = str(row.site_uuid)
-        generation_power_kw = np.round(row.generation_power_kw, 3)
-        pv_actual_values_per_site[site_uuid].append(
-            PVActualValue(
-                datetime_utc=row.start_utc,
+        pv_actual_values = [
+            PVActualValue.model_construct(
+                datetime_utc=start_utc,
                 actual_generation_kw=generation_power_kw,
             )
+            for start_utc, generation_power_kw in zip(
+                row.start_utc, round_values(row.generation_power_kw)
+            )
+        ]
+        multiple_pv_actuals.append(
+            MultiplePVActual.model_construct(
+                site_uuid=str(row.site_uuid), pv_actual_values=pv_actual_values
+            )
         )
 
-    logger.info("Formatting generation 2")
-    multiple_pv_actuals = [
-        MultiplePVActual(site_uuid=site_uuid, pv_actual_values=pv_actual_values)
-        for site_uuid, pv_actual_values in pv_actual_values_per_site.items()
-    ]
-    logger.debug(f"Getting generation for {len(site_uuids)} sites: done")
+    logger.debug(f"Formatted generation for {len(multiple_pv_actuals)} sites")
     return multiple_pv_actuals
 
 
-def generation_rows_to_pydantic_compact(rows) -> MultipleSitePVActualCompact:
+def generation_rows_to_pydantic_compact(rows: Iterable[Row]) -> MultipleSitePVActualCompact:
     """Convert generation rows to a MultiplePVActualBySite object.
 
-    This produces a compact version of the generation data."""
-    pv_actual_values_per_site = {}
+    This produces a compact version of the generation data. Each row holds all the generation
+    values of one site."""
     start_utc_idx = {}
+    multiple_pv_actuals = []
     for row in rows:
-        site_uuid = str(row.site_uuid)
-        start_utc = row.start_utc
-        generation_power_kw = np.round(row.generation_power_kw, 3)
-
-        if start_utc not in start_utc_idx:
-            start_utc_idx[start_utc] = len(start_utc_idx)
-        idx = start_utc_idx[start_utc]
+        pv_actual_values = {}
+        for start_utc, generation_power_kw in zip(
+            row.start_utc, round_values(row.generation_power_kw)
+        ):
+            if start_utc not in start_utc_idx:
+                start_utc_idx[start_utc] = len(start_utc_idx)
+            pv_actual_values[start_utc_idx[start_utc]] = generation_power_kw
 
-        if site_uuid in pv_actual_values_per_site:
-            pv_actual_values_per_site[site_uuid][idx] = generation_power_kw
-        else:
-            pv_actual_values_per_site[site_uuid] = {idx: generation_power_kw}
-
-    multiple_pv_actuals = []
-    for site_uuid, pv_actual_values in pv_actual_values_per_site.items():
         multiple_pv_actuals.append(
-            MultiplePVActualCompact(site_uuid=site_uuid, pv_actual_values=pv_actual_values)
+            MultiplePVActualCompact.model_construct(
+                site_uuid=str(row.site_uuid), pv_actual_values=pv_actual_values
+            )
         )
 
-    return MultipleSitePVActualCompact(
+    return MultipleSitePVActualCompact.model_construct(
         pv_actual_values_many_site=multiple_pv_actuals, start_utc_idx=start_utc_idx
     )
 
 
-def forecast_rows_sums_to_pydantic_objects(rows):
+def forecast_rows_sums_to_pydantic_objects(rows: Iterable[Row]):
     """Convert forecast rows to a list of ForecastValueSum object.
 
     These forecasts are summed by total, dno, or gsp in the database
@@ -183,11 +200,11 @@ def forecast_rows_sums_to_pydantic_objects(rows):
     forecasts = []
     for forecast_raw in rows:
         if len(forecast_raw) == 2:
-            generation = ForecastValueSum(
+            generation = ForecastValueSum.model_construct(
                 start_utc=forecast_raw[0], power_kw=forecast_raw[1], name="total"
             )
         else:
-            generation = ForecastValueSum(
+            generation = ForecastValueSum.model_construct(
                 start_utc=forecast_raw[0], power_kw=forecast_raw[2], name=forecast_raw[1]
             )
         forecasts.append(generation)
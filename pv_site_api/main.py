@@ -19,6 +19,7 @@ from pvsite_datamodel.pydantic_models import GenerationSum, PVSiteEditMetadata
 from pvsite_datamodel.read.site import get_site_by_uuid
 from pvsite_datamodel.read.status import get_latest_status
 from pvsite_datamodel.read.user import get_user_by_email
+from pvsite_datamodel.sqlmodels import UserSQL
 from pvsite_datamodel.write.generation import insert_generation_values
 from pvsite_datamodel.write.user_and_site import create_site, delete_site, edit_site
 from sqlalchemy.orm import Session
@@ -33,6 +34,7 @@ from ._db_helpers import (
     get_generation_by_sites,
     get_sites_by_uuids,
     get_sites_from_user,
+    invalidate_site_cache,
     site_to_pydantic,
 )
 from .auth import Auth
@@ -138,6 +140,20 @@ auth = Auth(
     algorithm=os.getenv("AUTH0_ALGORITHM"),
 )
 
+
+def get_user(
+    session: Session = Depends(get_session), auth: dict = Depends(auth)
+) -> Optional[UserSQL]:
+    """Get the user making the request.
+
+    FastAPI caches dependencies, so the user is only loaded once per request.
+    """
+    if is_fake():
+        return None
+
+    return get_user_by_email(session=session, email=auth["https://openclimatefix.org/email"])
+
+
 route_tags = [
     {
         "name": "Sites",
@@ -183,6 +199,7 @@ async def add_process_time_header(request: Request, call_next):
 def get_sites(
     session: Session = Depends(get_session),
     auth: dict = Depends(auth),
+    user: Optional[UserSQL] = Depends(get_user),
     latitude_longitude_max: Optional[str] = None,
     latitude_longitude_min: Optional[str] = None,
 ):
@@ -200,8 +217,6 @@ def get_sites(
     if is_fake():
         return make_fake_site()
 
-    user = get_user_by_email(session=session, email=auth["https://openclimatefix.org/email"])
-
     lat_lon_limits = format_latitude_longitude(
         latitude_longitude_max=latitude_longitude_max, latitude_longitude_min=latitude_longitude_min
     )
@@ -264,8 +279,11 @@ def post_pv_actual(
         print("Not doing anything with it (yet!)")
         return
 
+    # only load the user once the request is accepted, as this can create the user
+    user = get_user(session=session, auth=auth)
+
     # make sure user has access to this site
-    check_user_has_access_to_site(session=session, auth=auth, site_uuid=site_uuid)
+    check_user_has_access_to_site(session=session, user=user, site_uuid=site_uuid)
 
     generations = []
     for pv_actual_value in pv_actual.pv_actual_values:
@@ -333,11 +351,15 @@ def put_site_info(
     if not site_exists:
         raise HTTPException(status_code=404, detail=f"Site with {site_uuid=} does not exist")
 
+    # only load the user once we know the site exists, as this can create the user
+    user = get_user(session=session, auth=auth)
+
     # make sure user has access to this site
-    check_user_has_access_to_site(session=session, auth=auth, site_uuid=site_uuid)
+    check_user_has_access_to_site(session=session, user=user, site_uuid=site_uuid)
 
     # update site informations
     site, message = edit_site(session=session, site_uuid=site_uuid, site_info=site_info)
+    invalidate_site_cache(site_uuid)
 
     logger.debug(message)
 
@@ -349,6 +371,7 @@ def post_site_info(
     site_info: PVSiteInputMetadata,
     session: Session = Depends(get_session),
     auth: dict = Depends(auth),
+    user: Optional[UserSQL] = Depends(get_user),
 ) -> PVSiteMetadata:
     """
     ### This route allows a user to add a site.
@@ -365,8 +388,6 @@ def post_site_info(
         site = make_fake_site().site_list[0]
         return site
 
-    user = get_user_by_email(session=session, email=auth["https://openclimatefix.org/email"])
-
     site, message = create_site(
         session=session,
         client_site_id=site_info.client_site_id,
@@ -398,6 +419,7 @@ def delete_site_info(
     site_uuid: str,
     session: Session = Depends(get_session),
     auth: dict = Depends(auth),
+    user: Optional[UserSQL] = Depends(get_user),
 ):
     """
     ### This route allows a user to delte a site.
@@ -409,10 +431,11 @@ def delete_site_info(
         return {"message": "Site deleted successfully"}
 
     # check user has access to site
-    check_user_has_access_to_site(session=session, auth=auth, site_uuid=site_uuid)
+    check_user_has_access_to_site(session=session, user=user, site_uuid=site_uuid)
 
     # delete site
     message = delete_site(session=session, site_uuid=site_uuid)
+    invalidate_site_cache(site_uuid)
 
     return message
 
@@ -442,10 +465,13 @@ def get_pv_actual(
     if not site_exists:
         raise HTTPException(status_code=404)
 
-    check_user_has_access_to_site(session=session, auth=auth, site_uuid=site_uuid)
+    # only load the user once we know the site exists, as this can create the user
+    user = get_user(session=session, auth=auth)
+
+    check_user_has_access_to_site(session=session, user=user, site_uuid=site_uuid)
 
     actuals = get_pv_actual_many_sites(
-        site_uuids=site_uuid, session=session, auth=auth, request=request
+        site_uuids=site_uuid, session=session, auth=auth, user=user, request=request
     )
 
     if len(actuals) == 0:
@@ -466,6 +492,7 @@ def get_pv_actual_many_sites(
     session: Session = Depends(get_session),
     sum_by: Optional[str] = None,
     auth: dict = Depends(auth),
+    user: Optional[UserSQL] = Depends(get_user),
     compact: bool = False,
     start_utc: Optional[str] = None,
     end_utc: Optional[str] = None,
@@ -501,20 +528,20 @@ def get_pv_actual_many_sites(
     if is_fake():
         return [make_fake_pv_generation(site_uuid) for site_uuid in site_uuids_list]
 
-    # check that uuids are given
+    # check that uuids are given, and parse them only once
     try:
-        [uuid.UUID(site_uuid) for site_uuid in site_uuids_list]
+        site_uuids_parsed = [uuid.UUID(site_uuid) for site_uuid in site_uuids_list]
     except ValueError:
         raise HTTPException(status_code=422, detail="Invalid site_uuids list.")
 
-    check_user_has_access_to_sites(session=session, auth=auth, site_uuids=site_uuids_list)
+    check_user_has_access_to_sites(session=session, user=user, site_uuids=site_uuids_parsed)
 
     if start_utc is None:
         start_utc = get_yesterday_midnight()
 
     return get_generation_by_sites(
         session,
-        site_uuids=site_uuids_list,
+        site_uuids=site_uuids_parsed,
         start_utc=start_utc,
         compact=compact,
         sum_by=sum_by,
@@ -553,10 +580,13 @@ def get_pv_forecast(
     if not site_exists:
         raise HTTPException(status_code=404)
 
-    check_user_has_access_to_site(session=session, auth=auth, site_uuid=site_uuid)
+    # only load the user once we know the site exists, as this can create the user
+    user = get_user(session=session, auth=auth)
+
+    check_user_has_access_to_site(session=session, user=user, site_uuid=site_uuid)
 
     forecasts = get_pv_forecast_many_sites(
-        site_uuids=site_uuid, session=session, auth=auth, request=request
+        site_uuids=site_uuid, session=session, auth=auth, user=user, request=request
     )
 
     if len(forecasts) == 0:
@@ -575,6 +605,7 @@ def get_pv_forecast_many_sites(
     site_uuids: str,
     session: Session = Depends(get_session),
     auth: dict = Depends(auth),
+    user: Optional[UserSQL] = Depends(get_user),
     sum_by: Optional[str] = None,
     start_utc: Optional[str] = None,
     end_utc: Optional[str] = None,
@@ -618,19 +649,19 @@ def get_pv_forecast_many_sites(
 
     site_uuids_list = site_uuids.split(",")
 
-    # check that uuids are given
+    # check that uuids are given, and parse them only once
     try:
-        [uuid.UUID(site_uuid) for site_uuid in site_uuids_list]
+        site_uuids_parsed = [uuid.UUID(site_uuid) for site_uuid in site_uuids_list]
     except ValueError:
         raise HTTPException(status_code=422, detail="Invalid site_uuids list.")
 
-    check_user_has_access_to_sites(session=session, auth=auth, site_uuids=site_uuids_list)
+    check_user_has_access_to_sites(session=session, user=user, site_uuids=site_uuids_parsed)
 
     logger.debug(f"Loading forecast from {start_utc}")
 
     forecasts = get_forecasts_by_sites(
         session,
-        site_uuids=site_uuids_list,
+        site_uuids=site_uuids_parsed,
         start_utc=start_utc,
         end_utc=end_utc,
         horizon_minutes=0,
@@ -682,8 +713,11 @@ def get_pv_estimate_clearsky_many_sites(
     if is_fake():
         sites = make_fake_site().site_list
     else:
-        site_uuids_list = site_uuids.split(",")
-        sites = get_sites_by_uuids(session, site_uuids_list)
+        try:
+            site_uuids_parsed = [uuid.UUID(site_uuid) for site_uuid in site_uuids.split(",")]
+        except ValueError:
+            raise HTTPException(status_code=422, detail="Invalid site_uuids list.")
+        sites = get_sites_by_uuids(session, site_uuids_parsed)
 
     res = []
 
@@ -2,6 +2,7 @@
 # import packages
 from datetime import datetime
 from typing import Dict, List, Optional
+from uuid import UUID
 
 from pydantic import BaseModel, Field, field_validator
 
@@ -68,7 +69,7 @@ class PVSiteInputMetadata(BaseModel):
 class PVSiteMetadata(PVSiteInputMetadata):
     """Site metadata"""
 
-    site_uuid: str = Field(..., json_schema_extra={"description": "The site's UUID"})
+    site_uuid: UUID = Field(..., json_schema_extra={"description": "The site's UUID"})
     capacity_kw: float = Field(
         ..., json_schema_extra={"description": "The site's total capacity in kw"}, ge=0
     )
@@ -2,10 +2,35 @@
 
 import os
 
-from pvsite_datamodel.connection import DatabaseConnection
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Connection pool settings. The defaults of sqlalchemy (5 connections, 10 overflow) are too small
+# when the API is under load.
+DB_POOL_SIZE = 20
+DB_MAX_OVERFLOW = 10
+DB_POOL_RECYCLE_SECONDS = 1800
+db_pool_size = int(os.getenv("DB_POOL_SIZE", DB_POOL_SIZE))
+db_max_overflow = int(os.getenv("DB_MAX_OVERFLOW", DB_MAX_OVERFLOW))
+db_pool_recycle_seconds = int(os.getenv("DB_POOL_RECYCLE_SECONDS", DB_POOL_RECYCLE_SECONDS))
+
+
+def make_session_maker(url: str) -> sessionmaker:
+    """Make a database session factory, with a tuned connection pool"""
+    engine = create_engine(
+        url,
+        echo=True,
+        pool_size=db_pool_size,
+        max_overflow=db_max_overflow,
+        # check connections are alive before using them, and renew them regularly
+        pool_pre_ping=True,
+        pool_recycle=db_pool_recycle_seconds,
+    )
+    return sessionmaker(bind=engine)
+
 
 try:
-    connection = DatabaseConnection(url=os.getenv("DB_URL", "not_set"))
+    session_maker = make_session_maker(url=os.getenv("DB_URL", "not_set"))
 except Exception as e:
     print(e)
     print("Could not connect to database")
@@ -16,5 +41,5 @@ def get_session():
     if int(os.environ.get("FAKE", 0)):
         yield None
     else:
-        with connection.get_session() as s:
+        with session_maker() as s:
             yield s
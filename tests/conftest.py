@@ -11,6 +11,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import Session
 from testcontainers.postgres import PostgresContainer
 
+from pv_site_api._db_helpers import _site_exists_cache, _sites_cache
 from pv_site_api.main import app, auth
 from pv_site_api.session import get_session
 
@@ -22,6 +23,13 @@ def _now(autouse=True):
         return datetime.utcnow()
 
 
+@pytest.fixture(autouse=True)
+def clear_site_caches():
+    """Empty the site caches, so that the tests don't depend on each other."""
+    _site_exists_cache.clear()
+    _sites_cache.clear()
+
+
 @pytest.fixture(scope="session")
 def engine():
     """Make database engine"""
@@ -4,8 +4,9 @@ import logging
 from datetime import datetime, timedelta, timezone
 
 import structlog
+from freezegun import freeze_time
 
-from pv_site_api.cache import remove_old_cache
+from pv_site_api.cache import TTLCache, remove_old_cache
 
 
 def get_logger():
@@ -65,3 +66,33 @@ def test_remove_old_cache(caplog):
 
         for message in expected_debug_messages:
             assert any(message in rec.message for rec in caplog.records)
+
+
+def test_ttl_cache():
+    """
+    Test entries expire, and the oldest entries are dropped when the cache is full
+    """
+    now = datetime.now(tz=timezone.utc)
+    cache = TTLCache(cache_time_seconds=60, max_size=2)
+
+    with freeze_time(now):
+        cache.set("key1", "response1")
+        cache.set("key2", "response2")
+        assert cache.get("key1") == "response1"
+
+    with freeze_time(now + timedelta(seconds=30)):
+        # the cache is full, so key1 is dropped
+        cache.set("key3", "response3")
+        assert cache.get("key1") is None
+        assert cache.get("key2") == "response2"
+
+    with freeze_time(now + timedelta(seconds=61)):
+        assert cache.get("key2") is None
+        assert cache.get("key3") == "response3"
+
+        cache.pop("key3")
+        assert cache.get("key3", "default") == "default"
+
+    cache.set("key4", "response4")
+    cache.clear()
+    assert cache.get("key4") is None
@@ -0,0 +1,13 @@
+""" Test for converting database rows """
+
+from pv_site_api.convert import round_values
+
+
+def test_round_values():
+    values = round_values([1.23456, 2.0])
+    assert values == [1.235, 2.0]
+    assert isinstance(values[0], float)
+
+    # Values close to a half are rounded like numpy does, which differs from python's `round`.
+    assert round(0.0025, 3) == 0.003
+    assert round_values([0.0025]) == [0.002]
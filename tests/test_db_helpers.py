@@ -0,0 +1,67 @@
+""" Test for the database helpers """
+import uuid
+
+from pvsite_datamodel.sqlmodels import SiteSQL
+from sqlalchemy import event
+
+from pv_site_api._db_helpers import does_site_exist, get_sites_by_uuids, site_to_pydantic
+from pv_site_api.pydantic_models import PVSiteMetadata
+
+
+def test_does_site_exist_only_caches_existing_sites(db_session):
+    site_uuid = uuid.uuid4()
+    assert not does_site_exist(db_session, str(site_uuid))
+
+    # The missing site was not cached, so it is found as soon as it is made.
+    site = SiteSQL(site_uuid=site_uuid, ml_id=123)
+    db_session.add(site)
+    db_session.commit()
+    assert does_site_exist(db_session, str(site_uuid))
+
+    # The site is now cached, in any form of its uuid.
+    db_session.delete(site)
+    db_session.commit()
+    assert does_site_exist(db_session, str(site_uuid).upper())
+
+
+def test_does_site_exist_invalid_uuid(db_session):
+    assert not does_site_exist(db_session, "not-a-uuid")
+
+
+def test_get_sites_by_uuids(db_session, sites):
+    site_uuids = [site.site_uuid for site in sites]
+
+    # Cache the first site.
+    get_sites_by_uuids(db_session, site_uuids[:1])
+
+    parameters = []
+
+    def before_cursor_execute(conn, cursor, statement, params, context, executemany):
+        parameters.append(params)
+
+    event.listen(db_session.bind, "before_cursor_execute", before_cursor_execute)
+    try:
+        pv_sites = get_sites_by_uuids(
+            db_session, [site_uuids[1], site_uuids[0], site_uuids[1], site_uuids[2]]
+        )
+    finally:
+        event.remove(db_session.bind, "before_cursor_execute", before_cursor_execute)
+
+    # The sites are in the order they were asked for, without duplicates.
+    assert [pv_site.site_uuid for pv_site in pv_sites] == [
+        site_uuids[1],
+        site_uuids[0],
+        site_uuids[2],
+    ]
+
+    # Only the sites missing from the cache were queried.
+    assert len(parameters) == 1
+    assert str(site_uuids[0]) not in str(parameters[0])
+    assert str(site_uuids[1]) in str(parameters[0])
+
+
+def test_site_to_pydantic(sites):
+    pv_site = site_to_pydantic(sites[0])
+
+    # The same as when the model is validated.
+    assert pv_site == PVSiteMetadata(**pv_site.model_dump())
@@ -5,7 +5,7 @@ from datetime import datetime, timedelta
 
 from freezegun import freeze_time
 from pvsite_datamodel.pydantic_models import ForecastValueSum
-from pvsite_datamodel.sqlmodels import SiteSQL
+from pvsite_datamodel.sqlmodels import ForecastSQL, ForecastValueSQL, SiteSQL, UserSQL
 
 from pv_site_api.pydantic_models import Forecast, ManyForecastCompact
 
@@ -36,6 +36,16 @@ def test_get_forecast(db_session, client, forecast_values):
     assert len(forecast.forecast_values) > 0
 
 
+def test_get_forecast_upper_case_uuid(db_session, client, forecast_values):
+    """The site uuid can be given in any form that `uuid.UUID` accepts."""
+    site_uuid = str(forecast_values[0].forecast.site_uuid).upper()
+    response = client.get(f"/sites/{site_uuid}/pv_forecast")
+    assert response.status_code == 200, response.text
+
+    forecast = Forecast(**response.json())
+    assert len(forecast.forecast_values) > 0
+
+
 def test_get_forecast_many_sites(db_session, client, forecast_values, sites):
     site_uuids = [str(s.site_uuid) for s in sites]
     site_uuids_str = ",".join(site_uuids)
@@ -258,7 +268,98 @@ def test_get_forecast_user_no_access(db_session, client, sites):
     assert resp.status_code == 403
 
 
+def test_get_forecast_many_sites_user_no_access(db_session, client, sites):
+    # Make a brand new site.
+    site = SiteSQL(ml_id=123)
+    db_session.add(site)
+    db_session.commit()
+
+    # The user has access to all the sites but the new one.
+    site_uuids = [str(s.site_uuid) for s in sites] + [str(site.site_uuid)]
+    site_uuids_str = ",".join(site_uuids)
+
+    resp = client.get(f"/sites/pv_forecast?site_uuids={site_uuids_str}")
+    assert resp.status_code == 403
+    assert str(site.site_uuid) in resp.json()["detail"]
+
+
+def test_get_forecast_many_sites_upper_case_uuids(db_session, client, forecast_values, sites):
+    """The site uuids can be given in any form that `uuid.UUID` accepts."""
+    site_uuids = [str(s.site_uuid).upper() for s in sites]
+    site_uuids_str = ",".join(site_uuids)
+
+    resp = client.get(f"/sites/pv_forecast?site_uuids={site_uuids_str}")
+    assert resp.status_code == 200
+
+    forecasts = [Forecast(**x) for x in resp.json()]
+    assert len(forecasts) == len(sites)
+
+
+def test_get_forecast_many_sites_duplicate_without_horizon(db_session, client, sites):
+    """A duplicate forecast without values for the horizon doesn't hide the other forecast."""
+    site_uuid = sites[0].site_uuid
+    timestamp = datetime.utcnow() - timedelta(hours=1)
+
+    # Two forecasts for the same time, where only the first one has a value for horizon 0.
+    forecast_1 = ForecastSQL(
+        forecast_uuid=uuid.UUID(int=1),
+        site_uuid=site_uuid,
+        forecast_version="0.0.0",
+        timestamp_utc=timestamp,
+    )
+    forecast_2 = ForecastSQL(
+        forecast_uuid=uuid.UUID(int=2),
+        site_uuid=site_uuid,
+        forecast_version="0.0.0",
+        timestamp_utc=timestamp,
+    )
+    # A later forecast, so that neither of the two is the latest one.
+    forecast_3 = ForecastSQL(
+        site_uuid=site_uuid,
+        forecast_version="0.0.0",
+        timestamp_utc=timestamp + timedelta(minutes=30),
+    )
+    db_session.add_all([forecast_1, forecast_2, forecast_3])
+    db_session.commit()
+
+    db_session.add_all(
+        [
+            ForecastValueSQL(
+                forecast_power_kw=1,
+                forecast_uuid=forecast_1.forecast_uuid,
+                start_utc=timestamp,
+                end_utc=timestamp + timedelta(minutes=15),
+                horizon_minutes=0,
+            ),
+            ForecastValueSQL(
+                forecast_power_kw=2,
+                forecast_uuid=forecast_2.forecast_uuid,
+                start_utc=timestamp + timedelta(minutes=15),
+                end_utc=timestamp + timedelta(minutes=30),
+                horizon_minutes=15,
+            ),
+        ]
+    )
+    db_session.commit()
+
+    resp = client.get(f"/sites/pv_forecast?site_uuids={site_uuid}")
+    assert resp.status_code == 200
+
+    forecasts = [Forecast(**x) for x in resp.json()]
+    assert len(forecasts) == 1
+    assert [fv.target_datetime_utc for fv in forecasts[0].forecast_values] == [timestamp]
+
+
 def test_get_forecast_404(db_session, client):
     """If we get forecasts for an unknown site, we get a 404."""
     resp = client.get(f"/sites/{uuid.uuid4()}/pv_forecast")
     assert resp.status_code == 404
+
+    # The user is not created for a request that fails.
+    assert db_session.query(UserSQL).count() == 0
+
+
+def test_get_forecast_invalid_uuid(db_session, client):
+    """If we get forecasts for an invalid site uuid, we get a 404."""
+    resp = client.get("/sites/not-a-uuid/pv_forecast")
+    assert resp.status_code == 404
@@ -4,6 +4,7 @@ import json
 from datetime import datetime, timezone
 
 from pvsite_datamodel.pydantic_models import PVSiteEditMetadata
+from pvsite_datamodel.sqlmodels import UserSQL
 
 from pv_site_api import __version__
 from pv_site_api.pydantic_models import MultiplePVActual, PVActualValue, PVSiteAPIStatus
@@ -71,6 +72,23 @@ def test_post_too_large_pv_actual(client, fake):
     assert response.json() == {"detail": "Payload too large"}
 
 
+def test_post_too_large_pv_actual_no_user(db_session, client):
+    """A rejected request doesn't create the user"""
+    pv_actual_value = PVActualValue(
+        datetime_utc=datetime.now(timezone.utc), actual_generation_kw=73.3
+    )
+    fake_pv_actual_iteration = MultiplePVActual(
+        site_uuid="fff-fff",
+        pv_actual_values=[pv_actual_value] * 30000,
+    )
+    obj = json.loads(fake_pv_actual_iteration.json())
+
+    response = client.post("/sites/fff-fff-fff/pv_actual", json=obj)
+    assert response.status_code == 413
+
+    assert db_session.query(UserSQL).count() == 0
+
+
 def test_delete_site(client, fake):
     response = client.delete("/sites/delete/fff-fff-fff")
 
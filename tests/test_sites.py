@@ -4,6 +4,7 @@ from datetime import datetime, timezone
 
 from pvsite_datamodel.sqlmodels import SiteSQL
 
+from pv_site_api._db_helpers import does_site_exist, get_sites_by_uuids
 from pv_site_api.pydantic_models import PVSiteInputMetadata, PVSites
 
 
@@ -139,3 +140,30 @@ def test_put_site_and_update(db_session, client):
     assert len(sites) == 1
     assert sites[0].orientation == 120
     assert sites[0].tilt == 90
+
+
+def test_put_site_invalidates_cache(db_session, client, sites):
+    site_uuid = sites[0].site_uuid
+
+    # Cache the site.
+    get_sites_by_uuids(db_session, [site_uuid])
+
+    response = client.put(f"sites/{site_uuid}", json={"orientation": 120})
+    assert response.status_code == 200, response.text
+
+    pv_sites = get_sites_by_uuids(db_session, [site_uuid])
+    assert pv_sites[0].orientation == 120
+
+
+def test_delete_site_invalidates_cache(db_session, client, sites):
+    site_uuid = sites[0].site_uuid
+
+    # Cache the site.
+    assert does_site_exist(db_session, str(site_uuid))
+    get_sites_by_uuids(db_session, [site_uuid])
+
+    response = client.delete(f"sites/delete/{site_uuid}")
+    assert response.status_code == 200, response.text
+
+    assert not does_site_exist(db_session, str(site_uuid))
+    assert get_sites_by_uuids(db_session, [site_uuid]) == []